@@ -1,103 +1,385 @@
+import atexit
+import hashlib
 import os
-from flask import Flask, render_template_string, request, redirect, jsonify, send_file
-from redis import Redis, RedisError
+import queue
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from flask import Flask, render_template_string, request, redirect
+import orjson
+from redis import BlockingConnectionPool, Redis, RedisError
 import logging
+from logging.handlers import QueueHandler, QueueListener
 
 # --- Constants & Configuration ---
 
 # The characters to use for the short ID, in Base62
 BASE62_CHARS = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
-BASE = len(BASE62_CHARS)
 
 # Allow hyphen and underscore in user-provided aliases for convenience
 ALIAS_EXTRA_CHARS = "-_"
-ALLOWED_ALIAS_CHARS = set(BASE62_CHARS + ALIAS_EXTRA_CHARS)
+ALIAS_CHARS_RE = re.compile(f"[{re.escape(BASE62_CHARS + ALIAS_EXTRA_CHARS)}]+")
 
 # Max length for a custom alias
 MAX_ALIAS_LENGTH = 32
 
+# Error messages returned by the API
+NO_REDIS_ERROR = "Redis connection not established"
+NO_URL_ERROR = "No URL provided"
+ALIAS_EMPTY_ERROR = "Empty alias"
+ALIAS_TOO_LONG_ERROR = f"Alias too long (max {MAX_ALIAS_LENGTH} characters)"
+ALIAS_RESERVED_ERROR = "That alias is reserved"
+ALIAS_INVALID_CHARS_ERROR = "Alias contains invalid characters (allowed: 0-9 a-z A-Z - _)"
+ALIAS_IN_USE_ERROR = "Alias already in use"
+DATABASE_ERROR = "Database error"
+INTERNAL_ERROR = "An internal error occurred"
+
+# Pre-serialized JSON bodies for the error responses above
+ERROR_BODIES = {
+    message: orjson.dumps({"error": message})
+    for message in (
+        NO_REDIS_ERROR, NO_URL_ERROR, ALIAS_EMPTY_ERROR, ALIAS_TOO_LONG_ERROR,
+        ALIAS_RESERVED_ERROR, ALIAS_INVALID_CHARS_ERROR, ALIAS_IN_USE_ERROR,
+        DATABASE_ERROR, INTERNAL_ERROR,
+    )
+}
+
 # Reserved single-segment names that shouldn't be allowed as aliases
-RESERVED_ALIASES = {"api", "static", "favicon.ico"}
+RESERVED_ALIASES = frozenset({"api", "static", "favicon.ico"})
 
 # The Redis key we use for our global counter
 URL_COUNTER_KEY = "next_url_id"
 
-# The prefix for the Redis key to look up a long URL
-SHORT_TO_LONG_PREFIX = "short:"
+# The prefix for the Redis key to look up a long URL. Each short URL is a hash
+# with fields "url", "ts" (creation time) and "hits" (redirect count)
+SHORT_TO_LONG_PREFIX = b"short:"
+
+# Public base URL for short links (e.g. "https://sho.rt/"). When unset, it is
+# taken from each request's host
+BASE_URL = os.environ.get('BASE_URL', '').rstrip('/')
+BASE_URL = BASE_URL + '/' if BASE_URL else None
+
+# In-process cache of hot redirects, per worker (0 disables it). Entries are
+# re-read from Redis after REDIRECT_CACHE_TTL seconds, or sooner if the URL
+# expires first, so a deleted URL keeps redirecting for at most that long
+REDIRECT_CACHE_SIZE = int(os.environ.get('REDIRECT_CACHE_SIZE', 16384))
+REDIRECT_CACHE_TTL = float(os.environ.get('REDIRECT_CACHE_TTL', 60))
+
+# Number of cached redirect hits to tally before writing them to Redis
+HIT_FLUSH_THRESHOLD = int(os.environ.get('HIT_FLUSH_THRESHOLD', 100))
+
+# Optional lifetime for created short URLs, in seconds (0 = never expire)
+URL_TTL_SECONDS = int(os.environ.get('URL_TTL_SECONDS', 0))
+
+# Lua script that allocates the next ID, encodes it in Base62 and stores the
+# long URL in a single round-trip; this is the app's only Base62 encoder.
+#   KEYS[1]: counter key
+#   ARGV[1]: long URL, ARGV[2]: key prefix, ARGV[3]: Base62 alphabet,
+#   ARGV[4]: creation timestamp, ARGV[5]: TTL in seconds (0 = no expiry)
+# The short URL key depends on the new ID, so it is built inside the script
+# instead of being declared in KEYS. This is deliberate and only works on a
+# single Redis node, not on Redis Cluster.
+CREATE_URL_LUA = """
+local num = redis.call('INCR', KEYS[1])
+local alphabet = ARGV[3]
+local base = #alphabet
+local short_id = ''
+repeat
+    local rem = num % base
+    short_id = string.sub(alphabet, rem + 1, rem + 1) .. short_id
+    num = (num - rem) / base
+until num == 0
+local key = ARGV[2] .. short_id
+redis.call('HSET', key, 'url', ARGV[1], 'ts', ARGV[4])
+local ttl = tonumber(ARGV[5])
+if ttl > 0 then
+    redis.call('EXPIRE', key, ttl)
+end
+return short_id
+"""
+
+# Lua script that stores a long URL under a custom alias unless the alias is
+# already taken.
+#   KEYS[1]: short URL key
+#   ARGV[1]: long URL, ARGV[2]: creation timestamp,
+#   ARGV[3]: TTL in seconds (0 = no expiry)
+CREATE_ALIAS_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'url', ARGV[1], 'ts', ARGV[2])
+local ttl = tonumber(ARGV[3])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+
+# Lua helper prepended to the scripts below. Short URLs created before they
+# were stored as hashes are plain strings; it converts such a key to a hash
+# in place, keeping its TTL.
+UPGRADE_LEGACY_URL_LUA = """
+local function upgrade_legacy_url(key)
+    if redis.call('TYPE', key).ok ~= 'string' then
+        return
+    end
+    local long_url = redis.call('GET', key)
+    local pttl = redis.call('PTTL', key)
+    redis.call('DEL', key)
+    redis.call('HSET', key, 'url', long_url)
+    if pttl > 0 then
+        redis.call('PEXPIRE', key, pttl)
+    end
+end
+"""
+
+# Lua script that looks up a long URL and, only if it exists, counts the hit,
+# in a single round-trip. Returns the URL and the key's remaining TTL in
+# milliseconds (negative when it never expires), or nil.
+#   KEYS[1]: short URL key
+RESOLVE_URL_LUA = UPGRADE_LEGACY_URL_LUA + """
+upgrade_legacy_url(KEYS[1])
+local long_url = redis.call('HGET', KEYS[1], 'url')
+if not long_url then
+    return nil
+end
+redis.call('HINCRBY', KEYS[1], 'hits', 1)
+return {long_url, redis.call('PTTL', KEYS[1])}
+"""
+
+# Lua script that adds batched hit counts to short URLs that still exist, so
+# an expired URL isn't recreated as a hash holding only "hits".
+#   KEYS: short URL keys, ARGV: matching hit counts
+FLUSH_HITS_LUA = UPGRADE_LEGACY_URL_LUA + """
+for i, key in ipairs(KEYS) do
+    upgrade_legacy_url(key)
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('HINCRBY', key, 'hits', ARGV[i])
+    end
+end
+return 0
+"""
 
 # --- Flask & Redis Initialization ---
 
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+
+# Request threads only enqueue log records; a background thread writes them.
+# Records are formatted by the queue handler, so the writer adds nothing
+log_handler = logging.StreamHandler()
+log_queue_handler = QueueHandler(queue.SimpleQueue())
+logging.basicConfig(level=logging.INFO, handlers=[log_queue_handler])
+log_listener = None
+
+def start_log_listener():
+    """Start the background thread that writes queued log records.
+
+    Threads don't survive a fork, so gunicorn calls this again in each worker
+    after it has been forked (see gunicorn.conf.py).
+    """
+    global log_listener
+    # A fresh queue, in case the fork happened while the old one was locked
+    log_queue_handler.queue = queue.SimpleQueue()
+    log_listener = QueueListener(log_queue_handler.queue, log_handler)
+    log_listener.start()
+
+def stop_log_listener():
+    """Write any queued log records and stop the background thread."""
+    global log_listener
+    if log_listener:
+        log_listener.stop()
+        log_listener = None
+
+start_log_listener()
+atexit.register(stop_log_listener)
+
+# The index page is static, so read it once and serve it from memory
+with open(os.path.join(app.root_path, 'index.html'), 'rb') as f:
+    INDEX_HTML = f.read()
+INDEX_ETAG = hashlib.md5(INDEX_HTML).hexdigest()
 
 try:
     # Connect to Redis using environment variables or defaults
     redis_host = os.environ.get('REDIS_HOST', 'localhost')
     redis_port = int(os.environ.get('REDIS_PORT', 6379))
-    
-    redis_db = Redis(host=redis_host, port=redis_port, decode_responses=True)
+
+    # Share a bounded pool of persistent connections between worker threads;
+    # threads wait for a free connection instead of opening new sockets
+    redis_pool = BlockingConnectionPool(
+        host=redis_host,
+        port=redis_port,
+        max_connections=int(os.environ.get('REDIS_POOL', 64)),
+        # Replies stay bytes; only values that need to be text get decoded
+        decode_responses=False,
+        socket_keepalive=True,
+        socket_timeout=float(os.environ.get('REDIS_SOCKET_TIMEOUT', 5)),
+        # Every write is a non-idempotent script (new IDs, alias creation, hit
+        # counts), so a call whose reply timed out must not be re-sent
+        retry_on_timeout=False,
+        health_check_interval=30,
+    )
+    redis_db = Redis(connection_pool=redis_pool)
     redis_db.ping()
+    # Load the scripts up front; redis-py runs them via EVALSHA and reloads
+    # them on NOSCRIPT (e.g. after a Redis restart)
+    create_url_script = redis_db.register_script(CREATE_URL_LUA)
+    create_alias_script = redis_db.register_script(CREATE_ALIAS_LUA)
+    resolve_url_script = redis_db.register_script(RESOLVE_URL_LUA)
+    flush_hits_script = redis_db.register_script(FLUSH_HITS_LUA)
+    for script in (create_url_script, create_alias_script, resolve_url_script, flush_hits_script):
+        redis_db.script_load(script.script)
     app.logger.info(f"Successfully connected to Redis at {redis_host}:{redis_port}")
 
 except RedisError as e:
     app.logger.error(f"CRITICAL: Could not connect to Redis. {e}")
     redis_db = None
+    create_url_script = None
+    create_alias_script = None
+    resolve_url_script = None
+    flush_hits_script = None
+
+# --- Redirect Cache ---
+
+class RedirectCache:
+    """Thread-safe LRU cache mapping short IDs to long URLs.
+
+    Hits served from the cache are tallied locally until take_hits() is
+    called, so they can be written to Redis in batches.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.pending_hits = 0
+        self._entries = OrderedDict()
+        self._hits = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, short_id):
+        """Return the cached long URL and record a hit, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(short_id)
+            if entry is None:
+                return None
+            long_url, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[short_id]
+                return None
+            self._entries.move_to_end(short_id)
+            self._hits[short_id] += 1
+            self.pending_hits += 1
+            return long_url
+
+    def put(self, short_id, long_url, ttl=None):
+        """Cache a long URL for at most `ttl` seconds (capped by the cache's
+        own TTL), evicting the least recently used entry if full."""
+        if not self.maxsize:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[short_id] = (long_url, time.monotonic() + ttl)
+            self._entries.move_to_end(short_id)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def take_hits(self):
+        """Return the hits tallied since the last call and reset the tally."""
+        with self._lock:
+            hits, self._hits = self._hits, Counter()
+            self.pending_hits = 0
+        return hits
+
+redirect_cache = RedirectCache(REDIRECT_CACHE_SIZE, REDIRECT_CACHE_TTL)
 
 # --- Core Logic ---
 
-def to_base62(num):
-    """Encodes a positive integer into a Base62 string."""
-    if num == 0:
-        return BASE62_CHARS[0]
-    
-    arr = []
-    while num:
-        num, rem = divmod(num, BASE)
-        arr.append(BASE62_CHARS[rem])
-    arr.reverse()
-    return "".join(arr)
+def warm_redis_pool(size):
+    """Open up to `size` pooled Redis connections ahead of the first requests.
 
-def get_redis_key(short_id):
-    """Helper function to get the full Redis key for a short_id."""
-    return f"{SHORT_TO_LONG_PREFIX}{short_id}"
+    Connections don't survive a fork, so gunicorn calls this in each worker
+    after it has been forked (see gunicorn.conf.py).
+    """
+    if not redis_db:
+        return
+    size = min(size, redis_pool.max_connections)
+    connections = []
+    try:
+        for _ in range(size):
+            connections.append(redis_pool.get_connection("PING"))
+    except RedisError as e:
+        app.logger.warning(f"Could not pre-warm Redis connection pool: {e}")
+    finally:
+        for connection in connections:
+            redis_pool.release(connection)
+
+def flush_cached_hits():
+    """Write redirect hits served from the cache to Redis in one round-trip."""
+    hits = redirect_cache.take_hits()
+    if not hits or not redis_db:
+        return
+    try:
+        flush_hits_script(
+            keys=[SHORT_TO_LONG_PREFIX + short_id.encode() for short_id in hits],
+            args=list(hits.values()),
+        )
+    except RedisError as e:
+        app.logger.warning(f"Could not write {sum(hits.values())} cached hits to Redis: {e}")
 
 def is_valid_custom_alias(alias: str) -> (bool, str):
     """Validate a custom alias. Returns (is_valid, error_message)."""
     if not alias:
-        return False, "Empty alias"
+        return False, ALIAS_EMPTY_ERROR
     if len(alias) > MAX_ALIAS_LENGTH:
-        return False, f"Alias too long (max {MAX_ALIAS_LENGTH} characters)"
+        return False, ALIAS_TOO_LONG_ERROR
     if alias in RESERVED_ALIASES:
-        return False, "That alias is reserved"
-    for ch in alias:
-        if ch not in ALLOWED_ALIAS_CHARS:
-            return False, "Alias contains invalid characters (allowed: 0-9 a-z A-Z - _)"
+        return False, ALIAS_RESERVED_ERROR
+    if not ALIAS_CHARS_RE.fullmatch(alias):
+        return False, ALIAS_INVALID_CHARS_ERROR
     return True, ""
 
 # --- Flask Routes ---
 
+def json_response(body, status):
+    """Build a response from an already serialized JSON body."""
+    return app.response_class(body, status=status, mimetype='application/json')
+
+def error_response(message, status):
+    """Build a JSON error response from its pre-serialized body."""
+    return json_response(ERROR_BODIES[message], status)
+
 @app.route('/')
 def index():
     """Serve the index.html file."""
     if not redis_db:
         return "<h1>Error: Redis connection not established.</h1>", 500
-    return send_file('index.html')
+    response = app.response_class(INDEX_HTML, mimetype='text/html')
+    response.set_etag(INDEX_ETAG)
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    # Answers 304 Not Modified when If-None-Match matches
+    return response.make_conditional(request)
 
 @app.route('/api/create', methods=['POST'])
 def create_short_url():
     """API endpoint to create a new short URL. Supports optional custom alias."""
     if not redis_db:
-        return jsonify({"error": "Redis connection not established"}), 500
+        return error_response(NO_REDIS_ERROR, 500)
 
-    data = request.get_json(silent=True) or {}
-    long_url = (data.get('long_url') or "").strip()
-    custom_alias = (data.get('custom_alias') or "").strip()
+    # Missing, null and non-string fields all count as empty
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    long_url = data.get('long_url')
+    long_url = long_url.strip() if isinstance(long_url, str) else ""
+    custom_alias = data.get('custom_alias')
+    custom_alias = custom_alias.strip() if isinstance(custom_alias, str) else ""
 
     if not long_url:
-        return jsonify({"error": "No URL provided"}), 400
+        return error_response(NO_URL_ERROR, 400)
     
     # Basic check for a valid-looking URL
-    if not (long_url.startswith('http://') or long_url.startswith('https://')):
+    if not long_url.startswith(('http://', 'https://')):
         long_url = 'http://' + long_url
 
     try:
@@ -105,33 +387,37 @@ def create_short_url():
         if custom_alias:
             is_valid, err_msg = is_valid_custom_alias(custom_alias)
             if not is_valid:
-                return jsonify({"error": err_msg}), 400
+                return error_response(err_msg, 400)
 
-            redis_key = get_redis_key(custom_alias)
-            # NX option ensures we don't overwrite an existing alias
-            created = redis_db.set(redis_key, long_url, nx=True)
+            redis_key = SHORT_TO_LONG_PREFIX + custom_alias.encode('ascii')
+            # The script refuses to overwrite an existing alias
+            created = create_alias_script(
+                keys=[redis_key], args=[long_url, int(time.time()), URL_TTL_SECONDS]
+            )
             if created:
-                short_url = f"{request.host_url}{custom_alias}"
-                app.logger.info(f"Created custom alias {custom_alias} -> {long_url}")
-                return jsonify({"short_url": short_url}), 201
+                short_url = (BASE_URL or request.host_url) + custom_alias
+                if app.logger.isEnabledFor(logging.INFO):
+                    app.logger.info(f"Created custom alias {custom_alias} -> {long_url}")
+                return json_response(orjson.dumps({"short_url": short_url}), 201)
             else:
-                return jsonify({"error": "Alias already in use"}), 409
+                return error_response(ALIAS_IN_USE_ERROR, 409)
 
         # Otherwise, generate a new unique ID using the global counter
-        new_id_int = redis_db.incr(URL_COUNTER_KEY)
-        short_id = to_base62(new_id_int)
-        redis_key = get_redis_key(short_id)
-        redis_db.set(redis_key, long_url)
-        short_url = f"{request.host_url}{short_id}"
-        app.logger.info(f"Created auto alias {short_id} -> {long_url}")
-        return jsonify({"short_url": short_url}), 201
+        short_id = create_url_script(
+            keys=[URL_COUNTER_KEY],
+            args=[long_url, SHORT_TO_LONG_PREFIX, BASE62_CHARS, int(time.time()), URL_TTL_SECONDS],
+        ).decode('ascii')
+        short_url = (BASE_URL or request.host_url) + short_id
+        if app.logger.isEnabledFor(logging.INFO):
+            app.logger.info(f"Created auto alias {short_id} -> {long_url}")
+        return json_response(orjson.dumps({"short_url": short_url}), 201)
 
     except RedisError as e:
         app.logger.error(f"Redis error during URL creation: {e}")
-        return jsonify({"error": "Database error"}), 500
+        return error_response(DATABASE_ERROR, 500)
     except Exception as e:
         app.logger.error(f"Unknown error during URL creation: {e}")
-        return jsonify({"error": "An internal error occurred"}), 500
+        return error_response(INTERNAL_ERROR, 500)
 
 
 @app.route('/<string:short_id>')
@@ -141,13 +427,28 @@ def redirect_to_long_url(short_id):
         return "Error: Redis connection not established.", 500
 
     try:
-        # Look up the short_id in Redis
-        redis_key = get_redis_key(short_id)
-        long_url = redis_db.get(redis_key)
+        # Serve hot URLs from the in-process cache; their hits are written
+        # to Redis in batches
+        long_url = redirect_cache.get(short_id)
+        if long_url:
+            if redirect_cache.pending_hits >= HIT_FLUSH_THRESHOLD:
+                flush_cached_hits()
+        else:
+            # Look up the short_id in Redis and count the hit. The cache holds
+            # the decoded URL, so only misses pay for decoding
+            found = resolve_url_script(keys=[SHORT_TO_LONG_PREFIX + short_id.encode()])
+            if found:
+                long_url, pttl = found
+                long_url = long_url.decode()
+                # Don't serve the URL from the cache after it expires in Redis
+                redirect_cache.put(short_id, long_url, pttl / 1000 if pttl >= 0 else None)
+            else:
+                long_url = None
 
         if long_url:
             # Found it, redirect the user
-            app.logger.info(f"Redirecting {short_id} -> {long_url}")
+            if app.logger.isEnabledFor(logging.INFO):
+                app.logger.info(f"Redirecting {short_id} -> {long_url}")
             return redirect(long_url, code=302)
         else:
             # Not found
@@ -160,6 +461,8 @@ def redirect_to_long_url(short_id):
 
 # --- Run the App ---
 
+# Development server only; in production the app is served by gunicorn
+# (see gunicorn.conf.py)
 if __name__ == "__main__":
     # Use PORT environment variable if available (for Heroku, Railway, etc.)
     port = int(os.environ.get('PORT', 5001))
@@ -0,0 +1,41 @@
+import multiprocessing
+import os
+
+# --- Gunicorn Configuration ---
+# Loaded automatically by `gunicorn app:app` from the working directory.
+
+# Bind to the same port the dev server uses, or e.g. a unix socket when
+# running behind nginx (see docker-compose.yml)
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', 5001)}")
+
+# Trust X-Forwarded-* headers (client scheme) only from these addresses
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1,::1')
+
+# Seconds to keep idle client connections open between requests
+keepalive = int(os.environ.get('KEEPALIVE', 5))
+
+# Request handling is I/O-bound on Redis, so use threaded workers and let
+# the Redis round-trips of concurrent requests overlap
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 5))
+
+# Import the app once in the master before forking, so module globals are
+# shared copy-on-write across workers
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Restart the log writer thread and open one Redis connection per
+    worker thread before serving requests."""
+    import app
+    app.start_log_listener()
+    app.warm_redis_pool(server.cfg.threads)
+
+
+def worker_exit(server, worker):
+    """Write any redirect hits still tallied in the worker's cache, then any
+    queued log records."""
+    import app
+    app.flush_cached_hits()
+    app.stop_log_listener()